@@ -478,6 +478,366 @@ echo --
 apply up for
 """)
 
+# ### 5.5. Estimating the weights from a corpus
+#
+# The weights in section 5.3 were computed by hand from invented probabilities.
+# In practice, the probabilities are estimated from a corpus:
+#
+# <ul>
+#  <li>Run every word of the corpus through the analyzer.</li>
+#  <li>Split each analysis into the morphs that come from the lexc entries, for instance <code>poikanen+Pl+Ade</code> 🡒 <code>poikanen</code>, <code>+Pl</code>, <code>+Ade</code>.</li>
+#  <li>Count how often each morph is used. An ambiguous word gives each of its analyses an equal share of the count.</li>
+#  <li>Turn the counts into probabilities within each lexicon and the probabilities into logprobs.</li>
+# </ul>
+#
+# Some entries never occur in the corpus. They should not get probability zero (that is, an infinite weight),
+# so we use <i>add-k smoothing</i>: k is added to the count of every entry in the lexicon before normalizing.
+#
+# A large corpus does not fit in memory, so it is read in chunks. Each chunk is analysed separately,
+# possibly in a separate process, and only the counts are kept. The memory used depends on the number
+# of different morphs, not on the size of the corpus.
+
+import re
+from collections import Counter
+from itertools import islice
+from math import log10
+from multiprocessing import get_context
+from hfst_dev import HfstTransducer
+
+def morphs(analysis):
+    # 'poika#silla+Sg+Nom' -> ['poika', '#', 'silla', '+Sg', '+Nom']
+    return re.findall(r'\+[^+#]+|#|[^+#]+', analysis)
+
+def count_morphs(words, analyzer):
+    counts = Counter()
+    # Each distinct word is looked up only once.
+    for word, frequency in Counter(word.strip() for word in words).items():
+        analyses = analyzer.lookup(word) if word else ()
+        for analysis, weight in analyses:
+            for morph in morphs(analysis):
+                counts[morph] += frequency / len(analyses)
+    return counts
+
+# Each worker process reads its own copy of the analyzer.
+worker_analyzer = None
+
+def init_worker(analyzer_file):
+    global worker_analyzer
+    worker_analyzer = HfstTransducer.read_from_file(analyzer_file)
+
+def count_chunk(words):
+    return count_morphs(words, worker_analyzer)
+
+def count_corpus(corpus_file, analyzer_file, chunk_size=100000, processes=4):
+    counts = Counter()
+    # Worker processes are forked, so that they know the functions defined in this notebook.
+    with open(corpus_file, encoding='utf-8') as corpus, \
+         get_context('fork').Pool(processes, init_worker, (analyzer_file,)) as pool:
+        while True:
+            # Read only as many chunks as there are processes, so that the
+            # whole corpus is never in memory at the same time.
+            chunks = [list(islice(corpus, chunk_size)) for i in range(processes)]
+            chunks = [chunk for chunk in chunks if chunk]
+            if not chunks:
+                return counts
+            for chunk_counts in pool.map(count_chunk, chunks):
+                counts.update(chunk_counts)
+
+# The counts are turned into logprobs lexicon by lexicon.
+# The entries of each lexicon are read from the lexc source; the key of an entry is its upper (lexical) form.
+
+def lexc_entries(lexc):
+    entries = {}
+    lexicon = None
+    for line in lexc.splitlines():
+        line = line.split('!')[0].strip()
+        if line.startswith('LEXICON'):
+            lexicon = line.split()[1]
+            entries[lexicon] = []
+        elif lexicon and line.endswith(';') and not line.startswith('"'):
+            fields = line[:-1].split()
+            if len(fields) >= 2 and not fields[1].startswith('"'):
+                entries[lexicon].append(fields[0].split(':')[0])
+    return entries
+
+def estimate_weights(counts, entries, k=1.0):
+    total = sum(counts[entry] for entry in entries) + k * len(entries)
+    return {entry: -log10((counts[entry] + k) / total) for entry in entries}
+
+# The weights can be written back into the lexc source. Entries that already have a weight get a new one
+# and entries without a weight get one added; all other lines are left as they are.
+
+def reweight_lexc(lexc, weights):
+    entry = re.compile(r'^(\s*)(\S+)(\s+)(\S+)\s*(?:"weight:\s*[-0-9.e]+"\s*)?;(.*)$')
+    result = []
+    lexicon = None
+    for line in lexc.splitlines():
+        if line.strip().startswith('LEXICON'):
+            lexicon = line.split()[1]
+        match = entry.match(line)
+        if match and lexicon in weights and match.group(2).split(':')[0] in weights[lexicon]:
+            indent, form, space, continuation, comment = match.groups()
+            weight = weights[lexicon][form.split(':')[0]]
+            line = '%s%s%s%s "weight: %.5f" ;%s' % (indent, form, space, continuation, weight, comment)
+        result.append(line)
+    # The lexc compiler needs a newline after END.
+    return '\n'.join(result) + '\n'
+
+# Alternatively, the lexc source can be left as it is and the weights put in a separate <i>overlay</i> transducer.
+# The overlay splits a lexical string into morphs in the same way as <code>morphs</code> above and adds the weight of each morph.
+# A stem must always be followed by a tag or a compound boundary <code>#</code>, so a stem such as <code>poika</code> cannot match
+# the beginning of a longer stem such as <code>poikanen</code>. Composed on the lexical side of the generator, the overlay adds
+# the weights of all morphs (stems, tags and boundaries) to the paths of the generator.
+
+from hfst_dev import regex, compose
+
+def weight_overlay(weights):
+    morph_weights = {morph: weight for lexicon in weights.values() for morph, weight in lexicon.items()}
+    # Stems are written as strings of symbols {...}, tags and boundaries as single symbols "...".
+    stems = ' | '.join('{%s}::%f' % (morph, weight) for morph, weight in morph_weights.items() if not re.match(r'[+#]', morph))
+    suffixes = ' | '.join('"%s"::%f' % (morph, weight) for morph, weight in morph_weights.items() if re.match(r'[+#]', morph))
+    overlay = regex('[ [ %s ] [ %s ]+ ]+' % (stems, suffixes))
+    overlay.minimize()
+    return overlay
+
+# Let's try this with the lexicon of section 5.3. In real life, the corpus file would contain
+# millions of words, one word per line. Here we write a tiny corpus ourselves.
+
+lexc = """
+Multichar_Symbols +N +Sg +Pl +Nom +Ade +Abl ^A ^I ^J ^K ^S ^T
+
+LEXICON Root
+           Nouns ;
+
+LEXICON Nouns
+ilta:il^Ta          Number ;
+lauta:lau^Ta        Number ;
+lautanen:lauta^S    Number ;
+nainen:nai^S        Number ;
+poika:po^J^Ka       Number ;
+poikanen:poika^S    Number ;
+silla:silla         Number ;
+silta:sil^Ta        Number ;
+
+LEXICON Number
++Sg:0               Case ;
++Pl:^I              Case ;
+#:0                 Nouns ;
+
+LEXICON Case
++Nom:0              # ;
++Ade:ll^A           # ;
+
+END
+"""
+generator = compile_lexc_script(lexc)
+analyzer = HfstTransducer(generator)
+analyzer.invert()
+analyzer.minimize()
+analyzer.write_to_file('lecture3_analyzer.hfst')
+
+with open('lecture3_corpus.txt', 'w', encoding='utf-8') as corpus:
+    for word in ('poika^S^Ill^A', 'poika^S^Ill^A', 'po^J^Ka', 'nai^S', 'nai^S', 'nai^S', 'sil^Ta', 'il^Tall^A'):
+        print(word, file=corpus)
+
+counts = count_corpus('lecture3_corpus.txt', 'lecture3_analyzer.hfst', chunk_size=3, processes=2)
+entries = lexc_entries(lexc)
+weights = {lexicon: estimate_weights(counts, entries[lexicon]) for lexicon in ('Nouns', 'Number', 'Case')}
+print(reweight_lexc(lexc, weights))
+
+# The same weights as an overlay. The weights are the same as with the reweighted lexc source:
+
+weighted = compose((weight_overlay(weights), generator))
+weighted.invert()
+weighted.minimize()
+print(weighted.lookup('poika^S^Ill^A'))
+reweighted = compile_lexc_script(reweight_lexc(lexc, weights))
+reweighted.invert()
+print(reweighted.lookup('poika^S^Ill^A'))
+
+# ### 5.6. The cheapest word forms first
+#
+# In Assignment 3.3 you are asked to print random word forms sorted by weight.
+# A compound lexicon is infinite, so it is not possible to list all of its word forms and sort them.
+# But it is possible to list them in the order of increasing weight, one at a time, as long as we like:
+#
+# <ul>
+#  <li>Keep a priority queue of partial paths, ordered by their weight so far. In the beginning, there is just the empty path in the initial state.</li>
+#  <li>Take the cheapest partial path from the queue and extend it with every transition leaving its last state.</li>
+#  <li>If the last state is final, the path can also end there. The complete path goes back to the queue with the final weight added.</li>
+#  <li>When a complete path comes out of the queue, there cannot be any cheaper path left, so it can be output right away.</li>
+# </ul>
+#
+# This works as long as all weights are non-negative (as logprobs are): extending a path never makes it cheaper.
+# Because the paths are produced lazily, it does not matter that there are infinitely many of them.
+# The network should be minimized first, so that the same word form is not reached through many different paths.
+# Flag diacritics are not checked here.
+
+import heapq
+from itertools import count, islice
+from hfst_dev import HfstIterableTransducer, EPSILON
+
+def cheapest_paths(transducer):
+    fsm = HfstIterableTransducer(transducer)
+    def printable(symbol):
+        # epsilons, flag diacritics and other special symbols are not printed
+        return '' if symbol == EPSILON or (symbol.startswith('@') and symbol.endswith('@')) else symbol
+    # Read the transitions into plain tuples once, instead of every time a state is visited.
+    arcs = {state: [(arc.get_target_state(), printable(arc.get_input_symbol()),
+                     printable(arc.get_output_symbol()), arc.get_weight())
+                    for arc in fsm.transitions(state)]
+            for state in fsm.states()}
+    tiebreaker = count()
+    # (weight, tiebreaker, state, input, output); state None marks a complete path
+    queue = [(0.0, next(tiebreaker), 0, '', '')]
+    seen = set()
+    while queue:
+        weight, _, state, input, output = heapq.heappop(queue)
+        if state is None:
+            if (input, output) not in seen:
+                seen.add((input, output))
+                yield input, output, weight
+            continue
+        if fsm.is_final_state(state):
+            heapq.heappush(queue, (weight + fsm.get_final_weight(state), next(tiebreaker), None, input, output))
+        for target, insym, outsym, arc_weight in arcs[state]:
+            heapq.heappush(queue, (weight + arc_weight, next(tiebreaker), target, input + insym, output + outsym))
+
+# Let's take the lexicon from section 5.5 with the weights estimated there. It is infinite, because
+# <code>#:0</code> takes us back to the noun stems. The input side of the generator is the upper (lexical) side
+# and the output side is the lower (surface) side, so we get the cheapest lexical and surface forms together:
+
+weighted_generator = compile_lexc_script(reweight_lexc(lexc, weights))
+weighted_generator.minimize()
+for upper, lower, weight in islice(cheapest_paths(weighted_generator), 10):
+    print('%.5f\t%s\t%s' % (weight, upper, lower))
+
+# How long does it take to get the k cheapest forms? For comparison, <code>n_best</code> computes the same
+# paths as a new transducer, from which they are then extracted. <code>n_best</code> slows down quickly as k grows
+# (k = 10000 already takes about ten minutes), so it is timed only up to k = 1000.
+
+from time import perf_counter
+
+for k in (10, 100, 1000, 10000, 100000, 1000000):
+    start = perf_counter()
+    paths = list(islice(cheapest_paths(weighted_generator), k))
+    lazy = perf_counter() - start
+    if k <= 1000:
+        start = perf_counter()
+        n_best = HfstTransducer(weighted_generator)
+        n_best.n_best(k)
+        n_best.extract_paths()
+        print('k = %i: %.3f s lazily, %.3f s with n_best' % (k, lazy, perf_counter() - start))
+    else:
+        print('k = %i: %.3f s lazily' % (k, lazy))
+
+# ### 5.7. Caching spelling corrections
+#
+# A spell checker in use sees the same misspellings again and again. Instead of computing the corrections every time,
+# they can be stored in a cache on disk, so that they are kept also when the program is restarted.
+#
+# <ul>
+#  <li>The key of a cached correction is the name of the spell checker, its model, the misspelled word and the number <code>k</code> of corrections asked for.
+#      Several spell checkers can share the same cache file, if they have different names (by default, the name of the transducer file).</li>
+#  <li>The model is identified by a hash of the transducer file. When the vocabulary or the error model changes and the spell checker is recompiled, the hash changes.
+#      The corrections of the older versions of the same spell checker are then removed.</li>
+#  <li>Corrections older than <code>max_age</code> seconds are not used.</li>
+#  <li>When there are more than <code>max_entries</code> corrections in the cache, the ones that have not been used for the longest time are removed.</li>
+#  <li>The changes are saved to the file after every <code>batch_size</code> changes, so only a few are lost if the program crashes.</li>
+# </ul>
+#
+# Python's <code>sqlite3</code> module gives us a small database in a file for this.
+# First, let's compile the spell checker of section 5.4 and write it to a file:
+
+compile_xfst_script("""
+define Lexicon {for}|{fight}|{right}|{tight}|{of}|{or} ;
+define Substitution  [ f (->) d::1.000 ] .o. [ f (->) g::1.000 ] .o.
+                     [ f (->) r::1.602 ] .o. [ f (->) t::1.602 ] ;
+regex [ Lexicon .o. Substitution ].i ;
+save stack spellchecker.hfst
+""")
+
+import hashlib
+import json
+import sqlite3
+import time
+
+class CorrectionCache:
+
+    def __init__(self, filename, speller_file, name=None, max_entries=100000, max_age=7*24*60*60, batch_size=20):
+        with open(speller_file, 'rb') as f:
+            self.model = hashlib.sha256(f.read()).hexdigest()
+        self.name = speller_file if name is None else name
+        self.speller = HfstTransducer.read_from_file(speller_file)
+        self.max_entries = max_entries
+        self.max_age = max_age
+        self.batch_size = batch_size
+        self.changes = 0
+        self.hits = 0
+        self.misses = 0
+        self.db = sqlite3.connect(filename)
+        self.db.execute("""CREATE TABLE IF NOT EXISTS speller_corrections
+                           (speller TEXT, model TEXT, word TEXT, k INTEGER, corrections TEXT, created REAL, used REAL,
+                            PRIMARY KEY (speller, model, word, k))""")
+        # Corrections made by older versions of this spell checker are not valid.
+        self.db.execute('DELETE FROM speller_corrections WHERE speller = ? AND model != ?', (self.name, self.model))
+        self.db.commit()
+
+    def correct(self, word, k=5):
+        now = time.time()
+        key = (self.name, self.model, word, k)
+        row = self.db.execute("""SELECT corrections FROM speller_corrections
+                                 WHERE speller = ? AND model = ? AND word = ? AND k = ? AND created > ?""",
+                              key + (now - self.max_age,)).fetchone()
+        if row:
+            self.hits += 1
+            self.db.execute('UPDATE speller_corrections SET used = ? WHERE speller = ? AND model = ? AND word = ? AND k = ?',
+                            (now,) + key)
+            self.changed()
+            return [tuple(correction) for correction in json.loads(row[0])]
+        self.misses += 1
+        corrections = sorted(self.speller.lookup(word), key=lambda correction: correction[1])[:k]
+        self.db.execute('INSERT OR REPLACE INTO speller_corrections VALUES (?, ?, ?, ?, ?, ?, ?)',
+                        key + (json.dumps(corrections), now, now))
+        self.changed()
+        if self.misses % 1000 == 0:
+            self.evict()
+        return corrections
+
+    def changed(self):
+        self.changes += 1
+        if self.changes >= self.batch_size:
+            self.db.commit()
+            self.changes = 0
+
+    def evict(self):
+        self.db.execute('DELETE FROM speller_corrections WHERE created <= ?', (time.time() - self.max_age,))
+        self.db.execute("""DELETE FROM speller_corrections WHERE rowid NOT IN
+                           (SELECT rowid FROM speller_corrections ORDER BY used DESC LIMIT ?)""", (self.max_entries,))
+        self.db.commit()
+        self.changes = 0
+
+    def hit_ratio(self):
+        return self.hits / max(self.hits + self.misses, 1)
+
+    def close(self):
+        self.evict()
+        self.db.close()
+
+# Let's correct some words. The first time a word is seen, it is looked up in the spell checker,
+# after that it comes from the cache. The cache file remains when the notebook is closed, so we remove the file
+# of an earlier run first; otherwise the words would already be in the cache and the hit ratio would be different.
+
+import os
+
+if os.path.exists('corrections.sqlite'):
+    os.remove('corrections.sqlite')
+cache = CorrectionCache('corrections.sqlite', 'spellchecker.hfst')
+for word in ('dight', 'gor', 'dight', 'tight', 'dight', 'gor'):
+    print(word, cache.correct(word, k=2))
+print('hit ratio: %.2f' % cache.hit_ratio())
+cache.close()
+
 # ## 6. Summary of types of finite-state automata and transducers
 #
 # ### 6.1. Finite-state automaton (FSA)
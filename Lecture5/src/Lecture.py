@@ -7,7 +7,8 @@
 #  <li><a href="#4.-Regular-expressions-in-xfst">4. Regular expressions in xfst</a></li>
 #  <li><a href="#5.-Pronunciation-lexicon-for-a-Language-with-Irregular-Orthography:-English">5. Pronunciation lexicon for a Language with Irregular Orthography: English</a></li>
 #  <li><a href="#6.-Sound-Change-in-Indo-European-languages">6. Sound Change in Indo-European languages</a></li>
-#  <li><a href="#7.-Assignments">7. Assignments</a></li>
+#  <li><a href="#7.-Analysing-large-corpora">7. Analysing large corpora</a></li>
+#  <li><a href="#8.-Assignments">8. Assignments</a></li>
 # </ul>
 #
 # ## 1. Big picture
@@ -172,6 +173,410 @@ comp.parse_line('random-lower')
 #
 # <img src="img/porters_stemmer.png">
 
+# ### 2.7. Using the guesser only when needed
+#
+# The analyzer above gives guesses also for words that are in the lexicon: <code>donadas</code> gets
+# the analysis <code>donad+Guess+Verb+Pres</code> although <code>don+Verb+Cont+Pres</code> is known.
+# Usually we want to guess only the words that the lexicon does not recognize.
+#
+# First we save the analyzer and split it into a lexical analyzer (no <code>+Guess</code> in the analysis)
+# and a pure guesser (only analyses with <code>+Guess</code>):
+
+from hfst_dev import HfstTransducer, regex, compose
+comp.parse_line('save stack esperanto_verbs.hfst')
+full_analyzer = HfstTransducer.read_from_file('esperanto_verbs.hfst')
+full_analyzer.invert()
+lexical = compose((full_analyzer, regex('~$["+Guess"]')))
+guesser = compose((full_analyzer, regex('$["+Guess"]')))
+for transducer in (lexical, guesser):
+    transducer.minimize()
+
+# There are two ways to try the lexical analyzer first and the guesser only if the lexical analyzer fails:
+#
+# <ul>
+#  <li>Compile them into one transducer with <i>priority union</i>: the result contains the paths of <code>lexical</code>, and those paths of
+#      <code>guesser</code> whose input is not accepted by <code>lexical</code>. In xfst, this is written <code>lexical .P. guesser</code>.</li>
+#  <li>Keep them as separate transducers and look up the word in the guesser only when the lexical analyzer gives no result.</li>
+# </ul>
+
+compiled_chain = lexical.copy()
+compiled_chain.priority_union(guesser)
+compiled_chain.minimize()
+
+class AnalyzerChain:
+
+    def __init__(self, *analyzers):
+        self.analyzers = analyzers
+
+    def lookup(self, word):
+        for analyzer in self.analyzers:
+            analyses = analyzer.lookup(word)
+            if analyses:
+                return analyses
+        return ()
+
+runtime_chain = AnalyzerChain(lexical, guesser)
+
+for word in ('donadas', 'paroladas', 'hundo'):
+    print(word, compiled_chain.lookup(word), runtime_chain.lookup(word))
+
+# The compiled form needs only one lookup per word, but the transducer can grow when it is compiled.
+# The runtime form looks up unknown words twice, but the transducers stay as they are. Which one is faster
+# depends on how many words are unknown. Let's try with text where about every fifth word is not in the lexicon.
+# The unknown verbs have roots that the guesser accepts (consonant clusters such as <i>nt</i> in <i>kant</i> are not in <code>ConsClust</code>),
+# and a few words, such as <i>hundo</i>, get no analysis at all:
+
+from time import perf_counter
+import random
+
+rng = random.Random(0)
+endings = ('as', 'is', 'os', 'us', 'i', 'u', 'adas', 'adis')
+known = [root + ending for root in ('dir', 'don', 'est', 'ir', 'pens') for ending in endings]
+unknown = [root + ending for root in ('parol', 'labor', 'vid', 'kur', 'sid') for ending in endings] + ['la', 'kaj', 'hundo']
+words = [rng.choice(unknown) if rng.random() < 0.2 else rng.choice(known) for i in range(100000)]
+
+for name, transducer in (('lexical', lexical), ('guesser', guesser), ('compiled chain', compiled_chain)):
+    print('%s: %i states' % (name, transducer.number_of_states()))
+    transducer.lookup_optimize()
+
+for name, chain in (('compiled', compiled_chain), ('runtime', runtime_chain)):
+    start = perf_counter()
+    for word in words:
+        chain.lookup(word)
+    print('%s: %.0f words/s' % (name, len(words) / (perf_counter() - start)))
+
+# Both forms give the same analyses:
+
+assert all(sorted(compiled_chain.lookup(word)) == sorted(runtime_chain.lookup(word)) for word in set(words))
+
+# ### 2.8. Sampling many random paths at once
+#
+# <code>random-upper</code> and <code>random-lower</code> give a few random strings at a time. For testing, or for
+# creating training data, we may need millions of them. We can sample them much faster with NumPy if we first
+# compute how the paths are distributed in the network:
+#
+# <ul>
+#  <li>Because of the cycles, there are infinitely many paths. We consider only paths of at most <code>max_length</code> transitions.</li>
+#  <li><code>mass[k, s]</code> is the number of accepting paths from state <code>s</code> with at most <code>k</code> transitions. The path either ends in <code>s</code>
+#      (if <code>s</code> is final) or continues with a transition to a state <code>t</code>, from where there are <code>mass[k-1, t]</code> paths.</li>
+#  <li>When <code>weighted=True</code>, a path is not counted as one but as 10<sup>-w</sup>, where <code>w</code> is its weight. Then paths with small weights are sampled more often.</li>
+#  <li>All random walks (<i>walkers</i>) take their steps together: at each step, each walker either stops or chooses a transition
+#      with probability proportional to the mass behind it. This way, all paths of at most <code>max_length</code> transitions are equally likely (or proportional to 10<sup>-w</sup>).</li>
+# </ul>
+
+import numpy as np
+from hfst_dev import HfstIterableTransducer, EPSILON
+
+def printable(symbol):
+    # Special symbols, such as epsilon and flag diacritics, are left out of the output strings.
+    return '' if symbol == EPSILON or (symbol.startswith('@') and symbol.endswith('@')) else symbol
+
+class PathSampler:
+
+    def __init__(self, transducer, max_length=20, weighted=False):
+        fsm = HfstIterableTransducer(transducer)
+        states = sorted(fsm.states())
+        arcs = [(state, arc.get_target_state(), arc.get_input_symbol(), arc.get_output_symbol(), arc.get_weight())
+                for state in states for arc in fsm.transitions(state)]
+        self.max_length = max_length
+        self.symbols = sorted({symbol for arc in arcs for symbol in arc[2:4]})
+        symbol_ids = {symbol: i for i, symbol in enumerate(self.symbols)}
+        sources = np.array([arc[0] for arc in arcs], dtype=np.int64)
+        self.offsets = np.concatenate(([0], np.cumsum(np.bincount(sources, minlength=len(states)))))
+        self.targets = np.array([arc[1] for arc in arcs], dtype=np.int64)
+        self.inputs = np.array([symbol_ids[arc[2]] for arc in arcs], dtype=np.int64)
+        self.outputs = np.array([symbol_ids[arc[3]] for arc in arcs], dtype=np.int64)
+        weights = np.array([arc[4] for arc in arcs], dtype=np.float64)
+        final_weights = np.array([fsm.get_final_weight(state) if fsm.is_final_state(state) else np.inf for state in states])
+        if not weighted:
+            weights = np.zeros_like(weights)
+            final_weights = np.where(np.isinf(final_weights), np.inf, 0.0)
+        arc_mass = 10.0 ** -weights
+        final_mass = 10.0 ** -final_weights
+        mass = np.zeros((max_length + 1, len(states)))
+        mass[0] = final_mass
+        # For each k, the probabilities of stopping in each state and the cumulative probabilities of the transitions.
+        # The transitions of state s take the interval cumulative[k, offsets[s]] ... cumulative[k, offsets[s+1]].
+        self.stop = np.zeros((max_length + 1, len(states)))
+        self.cumulative = np.zeros((max_length + 1, len(arcs) + 1))
+        for k in range(1, max_length + 1):
+            arc_total = arc_mass * mass[k - 1, self.targets]
+            mass[k] = final_mass + np.bincount(sources, weights=arc_total, minlength=len(states))
+            self.stop[k] = np.divide(final_mass, mass[k], out=np.zeros(len(states)), where=mass[k] > 0)
+            probabilities = np.divide(arc_total, mass[k, sources], out=np.zeros(len(arcs)), where=mass[k, sources] > 0)
+            self.cumulative[k, 1:] = np.cumsum(probabilities)
+        if mass[max_length, 0] == 0:
+            raise ValueError('no accepting paths of at most %i transitions' % max_length)
+        self.number_of_paths = mass[max_length, 0]
+
+    def sample_ids(self, n, side='input', rng=None):
+        # Returns an array with one column of symbol ids for each sample; -1 marks the end of the path.
+        rng = np.random.default_rng(rng)
+        labels = self.inputs if side == 'input' else self.outputs
+        paths = np.full((self.max_length, n), -1)
+        states = np.zeros(n, dtype=np.int64)
+        walkers = np.arange(n)
+        for step, k in enumerate(range(self.max_length, 0, -1)):
+            u = rng.random(len(walkers))
+            stop = self.stop[k, states[walkers]]
+            walkers, u, stop = walkers[u >= stop], u[u >= stop], stop[u >= stop]
+            if len(walkers) == 0:
+                break
+            start = self.offsets[states[walkers]]
+            end = self.offsets[states[walkers] + 1]
+            # u - stop is the position of the walker in the interval of its state's transitions.
+            arcs = np.searchsorted(self.cumulative[k], self.cumulative[k, start] + (u - stop), side='right') - 1
+            arcs = np.clip(arcs, start, end - 1)
+            paths[step, walkers] = labels[arcs]
+            states[walkers] = self.targets[arcs]
+        return paths
+
+    def sample(self, n, side='input', rng=None):
+        # The last item is for the id -1 that marks the end of a path.
+        strings = np.array([printable(symbol) for symbol in self.symbols] + [''], dtype=object)
+        return [''.join(path) for path in strings[self.sample_ids(n, side, rng)].T]
+
+# The analyzer of section 2.7 has surface forms as input and analyses as output, so <code>side='output'</code>
+# corresponds to <code>random-upper</code> and <code>side='input'</code> to <code>random-lower</code>:
+
+sampler = PathSampler(full_analyzer, max_length=20)
+print('%.3g paths' % sampler.number_of_paths)
+print(sampler.sample(5, side='output', rng=0))
+print(sampler.sample(5, side='input', rng=0))
+
+start = perf_counter()
+samples = sampler.sample(1000000, side='input', rng=1)
+print('1000000 samples in %.2f s' % (perf_counter() - start))
+
+# Almost all paths of the network go through the guesser: there are about 10<sup>17</sup> guesses of at most 20 transitions,
+# but only 60 known verb forms. A small weight for the guesses would change nothing visible. If we give guesses the weight 16,
+# a known verb is 10<sup>16</sup> times as likely as any single guess in the weighted mode, and the guesses are left with about a fifth of the samples.
+# (<code>\"+Guess"</code> is any symbol except <code>+Guess</code>. A plain <code>?</code> would also match <code>+Guess</code> without a weight.)
+
+weighted_analyzer = compose((full_analyzer, regex('[ \\"+Guess" | "+Guess"::16 ]*')))
+for weighted in (False, True):
+    analyses = PathSampler(weighted_analyzer, max_length=20, weighted=weighted).sample(100000, side='output', rng=2)
+    print('weighted=%s: %.1f %% guesses' % (weighted, 100 * sum('+Guess' in analysis for analysis in analyses) / len(analyses)))
+
+# ### 2.9. From an analyzer to a lemmatizer
+#
+# In information retrieval, we often need only the lemma (base form) of each word, without the tags.
+# We could analyse the words and cut the tags away from the analyses in Python, but we can also
+# remove the tags from the analyzer itself: we compose it with a transducer that maps every tag to
+# epsilon and keeps all other symbols as they are. The other symbols are written <code>\[tag1 | tag2 | ...]</code>, any symbol except the tags.
+# (A plain <code>?</code> would not do: it also matches the tags, so they could pass through unchanged.)
+#
+# We start from the analyzer of section 2.7 that guesses only unknown words:
+
+analyzer = compose((full_analyzer, regex('~$["+Guess"]')))
+analyzer.priority_union(compose((full_analyzer, regex('$["+Guess"]'))))
+
+def lemmatizer(analyzer, is_tag=lambda symbol: symbol.startswith('+')):
+    tags = sorted(symbol for symbol in analyzer.get_alphabet() if is_tag(symbol))
+    quoted = ['"%s"' % tag for tag in tags]
+    result = compose((analyzer, regex('[ \\[%s] | %s ]*' % (' | '.join(quoted), ' | '.join(tag + ':0' for tag in quoted)))))
+    result.minimize()
+    result.lookup_optimize()
+    return result
+
+esperanto_lemmatizer = lemmatizer(analyzer)
+analyzer.lookup_optimize()
+print(analyzer.lookup('donadas'), esperanto_lemmatizer.lookup('donadas'))
+print(analyzer.lookup('paroladas'), esperanto_lemmatizer.lookup('paroladas'))
+
+# Different analyses can have the same lemma, so the lemmas of a word must be collected into a set.
+# In a corpus, the same words occur again and again, so we remember the lemmas of each word that we have seen.
+# The cache can be given as an argument, so that it can be shared by several calls:
+
+def lemmatize(words, lemmatizer, cache=None):
+    cache = {} if cache is None else cache
+    lemmas = []
+    for word in words:
+        if word not in cache:
+            cache[word] = sorted({lemma for lemma, weight in lemmatizer.lookup(word)})
+        lemmas.append(cache[word])
+    return lemmas
+
+def analyse_and_split(words, analyzer):
+    return [sorted({analysis.split('+')[0] for analysis, weight in analyzer.lookup(word)}) for word in words]
+
+# Let's compare the ways on the words of section 2.7:
+
+for name, function in (('analyse and split', lambda: analyse_and_split(words, analyzer)),
+                       ('lemmatizer', lambda: [sorted({lemma for lemma, weight in esperanto_lemmatizer.lookup(word)}) for word in words]),
+                       ('lemmatizer and cache', lambda: lemmatize(words, esperanto_lemmatizer))):
+    start = perf_counter()
+    lemmas = function()
+    print('%s: %.0f words/s' % (name, len(words) / (perf_counter() - start)))
+
+assert lemmatize(words, esperanto_lemmatizer) == analyse_and_split(words, analyzer)
+
+# ### 2.10. Referring to a sub-network instead of copying it
+#
+# <code>substitute defined PossibleVerbRoot for ^GUESSVERBROOT</code> in section 2.4 replaces the placeholder
+# transition with a copy of the network <code>PossibleVerbRoot</code>. If the placeholder occurs in many places,
+# for instance in a lexicon of compound words where every part of a compound can be any stem, the network
+# is copied many times.
+#
+# Instead, the placeholder transitions can be kept as <i>references</i> to a shared sub-network, which is
+# entered during lookup (this is known as a <i>recursive transition network</i>). When the sub-network reaches
+# a final state, lookup returns to the target state of the placeholder transition. The networks stay small, but
+# lookup must remember where to return, so it cannot be done with the normal lookup of HFST. Here, lookup is
+# written in Python:
+
+from hfst_dev import XreCompiler, compile_lexc_file
+
+def transition_table(transducer):
+    fsm = HfstIterableTransducer(transducer)
+    arcs = {state: [(arc.get_input_symbol(), arc.get_output_symbol(), arc.get_target_state(), arc.get_weight())
+                    for arc in fsm.transitions(state)]
+            for state in fsm.states()}
+    finals = {state: fsm.get_final_weight(state) for state in fsm.states() if fsm.is_final_state(state)}
+    return arcs, finals
+
+class ReferenceNetwork:
+
+    def __init__(self, main, subnetworks):
+        # The main network has the key None, the sub-networks have their placeholder symbols as keys.
+        self.networks = {None: transition_table(main)}
+        for placeholder, network in subnetworks.items():
+            self.networks[placeholder] = transition_table(network)
+
+    def lookup(self, word):
+        results = {}
+        # (network, state, position in word, output, weight, stack of (network, state) pairs to return to)
+        agenda = [(None, 0, 0, '', 0.0, ())]
+        seen = set()
+        while agenda:
+            configuration = agenda.pop()
+            if configuration in seen:
+                continue
+            seen.add(configuration)
+            network, state, position, output, weight, stack = configuration
+            arcs, finals = self.networks[network]
+            if state in finals:
+                if stack:
+                    return_network, return_state = stack[-1]
+                    agenda.append((return_network, return_state, position, output, weight + finals[state], stack[:-1]))
+                elif position == len(word):
+                    results[output] = min(weight + finals[state], results.get(output, float('inf')))
+            for input, arc_output, target, arc_weight in arcs[state]:
+                if input in self.networks:
+                    agenda.append((input, 0, position, output, weight + arc_weight, stack + ((network, target),)))
+                elif input == EPSILON:
+                    agenda.append((network, target, position, output + printable(arc_output), weight + arc_weight, stack))
+                elif word.startswith(input, position):
+                    agenda.append((network, target, position + len(input), output + printable(arc_output), weight + arc_weight, stack))
+        return sorted(results.items(), key=lambda result: result[1])
+
+# The main network is the lexc lexicon with the placeholder, and the sub-network is <code>PossibleVerbRoot</code>.
+# Both are inverted to make them analyzers:
+
+verb_lexicon = compile_lexc_file('esperanto.lexc')
+compiler = XreCompiler()
+compiler.define_transducer('Vowel', regex('a | e | i | o | u'))
+compiler.define_transducer('ConsClust', regex('b | c | d | f | g | h | j | k | l | m | n | p | r | s | t | v | z | '
+                                              'k r | p r | t r | g r | b r | d r | s k | s p | s t'))
+possible_verb_root = compiler.compile('( ConsClust ) [ [ Vowel ] [ ConsClust ] ]+ "+Guess":0')
+for transducer in (verb_lexicon, possible_verb_root):
+    transducer.invert()
+    transducer.minimize()
+rtn = ReferenceNetwork(verb_lexicon, {'^GUESSVERBROOT': possible_verb_root})
+print(rtn.lookup('donadas'))
+print(sorted(full_analyzer.lookup('donadas')))
+
+# Let's compare the sizes and lookup speeds of the networks with references and the network
+# where the placeholder has been substituted (<code>full_analyzer</code> of section 2.7):
+
+print('references: %i + %i states, %i + %i transitions' % (verb_lexicon.number_of_states(), possible_verb_root.number_of_states(),
+                                                          verb_lexicon.number_of_arcs(), possible_verb_root.number_of_arcs()))
+print('substituted: %i states, %i transitions' % (full_analyzer.number_of_states(), full_analyzer.number_of_arcs()))
+
+optimized_analyzer = full_analyzer.copy()
+optimized_analyzer.lookup_optimize()
+sample = words[:10000]
+for name, network in (('references', rtn), ('substituted', full_analyzer), ('substituted and optimized', optimized_analyzer)):
+    start = perf_counter()
+    for word in sample:
+        network.lookup(word)
+    print('%s: %.0f words/s' % (name, len(sample) / (perf_counter() - start)))
+
+assert all(sorted(analysis for analysis, weight in rtn.lookup(word)) == sorted(analysis for analysis, weight in full_analyzer.lookup(word))
+           for word in set(sample))
+
+# Here, the placeholder occurs only once and the sub-network is small, so substitution costs little memory and gives much
+# faster lookup. References pay off when a large sub-network would be copied into many places.
+
+# ### 2.11. A weighted guesser
+#
+# The guesser gives several analyses for a word: <code>donadas</code> got three, because the known root <i>don</i> can also be guessed, and the
+# guessed root can end before or after the continuous aspect <i>ad</i>. We can rank the analyses with weights (smaller is better) and ask only for the best ones:
+#
+# <ul>
+#  <li>Each vowel + consonant cluster of a guessed root gets a weight. Short roots, which leave more of the word to the known endings, are preferred.</li>
+#  <li>Each guess gets an extra weight, so analyses from the lexicon are preferred to guesses.</li>
+#  <li>The tags can get weights, too. Here, the continuous aspect <code>+Cont</code> is made a bit more expensive than the plain form.</li>
+# </ul>
+#
+# The weights are added to the script of section 2.4 with <code>::</code>, and the weights of the tags with a transducer
+# that accepts any analysis and gives a weight to the tags. As in section 2.9, the other symbols are written <code>\[tag1 | tag2 | ...]</code>,
+# because <code>?</code> would also match the tags without a weight.
+
+def weighted_guesser(output_file, syllable_weight=1.0, guess_weight=5.0, tag_weights={'+Cont': 0.5}):
+    compiler = XfstCompiler()
+    compiler.parse_line("""
+clear stack
+define Vowel     a | e | i | o | u ;
+define ConsClust b | c | d | f | g | h | j | k | l | m | n | p | r | s | t | v | z |
+                 k r | p r | t r | g r | b r | d r | s k | s p | s t ;
+define PossibleVerbRoot ( ConsClust ) [ [ [ Vowel ] [ ConsClust ] ]::%f ]+ "+Guess":0::%f ;
+read lexc esperanto.lexc
+substitute defined PossibleVerbRoot for ^GUESSVERBROOT
+define AllPossibleVerbs ;
+regex AllPossibleVerbs ;
+save stack %s
+""" % (syllable_weight, guess_weight, output_file))
+    guesser = HfstTransducer.read_from_file(output_file)
+    quoted = ['"%s"' % tag for tag in tag_weights]
+    tags = ' | '.join('%s::%f' % (tag, weight) for tag, weight in zip(quoted, tag_weights.values()))
+    guesser = compose((regex('[ \\[%s] | %s ]*' % (' | '.join(quoted), tags)), guesser))
+    guesser.minimize()
+    guesser.invert()
+    guesser.write_to_file(output_file)
+    return guesser
+
+weighted = weighted_guesser('esperanto_weighted.hfst')
+
+# To get the <code>k</code> best analyses of a word, we compose the word with the analyzer and keep the <code>k</code> best paths
+# of the result with <code>n_best</code>. Note that this does not save the work of finding all analyses: the composition builds all of them
+# before <code>n_best</code> is called. What it saves is listing the paths that are not needed with <code>extract_paths</code>.
+
+from hfst_dev import fst
+
+def best_analyses(word, analyzer, k=3):
+    paths = compose((fst(word), analyzer))
+    paths.n_best(k)
+    return sorted(paths.extract_paths().get(word, []), key=lambda path: path[1])
+
+print(best_analyses('donadas', weighted))
+print(best_analyses('paroladas', weighted, k=1))
+
+# Let's compare the time with listing all analyses as words get longer:
+
+def all_analyses(word, analyzer):
+    return sorted(compose((fst(word), analyzer)).extract_paths().get(word, []), key=lambda path: path[1])
+
+for syllables in (1, 2, 4, 8, 16):
+    word = 'par' + 'ol' * syllables + 'adas'
+    for name, function in (('all', lambda: all_analyses(word, weighted)), ('best 1', lambda: best_analyses(word, weighted, k=1))):
+        start = perf_counter()
+        analyses = function()
+        print('%i letters, %s: %i analyses, %.4f s' % (len(word), name, len(analyses), perf_counter() - start))
+
+# Each word has two analyses whatever its length, because the guessed root must be followed by the endings of the lexicon,
+# and both ways take about the same time: the composition is the same, and there are few paths to list. <code>n_best</code>
+# pays off only for words with many analyses.
+
 # ## 3. Pronunciation lexicon for a Language with (almost) regular Orthography: Brazilian Portuguese
 #
 # ### 3.1. Transducing between orthographic and pronounced forms of words
@@ -268,6 +673,189 @@ braços
 #
 # <img src="img/alternative_for_portuguese.png">
 
+# ### 3.6. Transcribing a large word list
+#
+# The xfst script of section 3.4 transcribes four words. To transcribe a pronunciation lexicon of hundreds of
+# thousands of words, we compile the rules in Python and compose them into one transducer. Then:
+#
+# <ul>
+#  <li>The word list is read line by line as a stream, and each different word is transcribed only once. To recognize the
+#      duplicates, the words seen so far must be kept in memory, but the list itself and the results are not.</li>
+#  <li>The words are transcribed in several processes at the same time. The processes are forked after the transducer has been set,
+#      so they all use the same transducer. <code>Pool.imap</code> reads its input as fast as it can, whether or not the processes keep up,
+#      so the words are given to it in batches of a few chunks per process. The same function is used for the sound changes of section 6.2 and the corpus pipeline
+#      of section 7.1 below.</li>
+#  <li>The result is written as tab-separated values: a word followed by its pronunciations.</li>
+# </ul>
+
+from hfst_dev import XreCompiler
+from itertools import islice
+from multiprocessing import get_context
+
+vowel = 'a | e | i | o | u | á | é | í | ó | ú | â | ê | ô | ã | õ | à | ü'
+portuguese_rules = ['s -> z || Vowel _ Vowel', 'ç -> s', 'c h -> %$', 'c -> s || _ [ e | i | é | í | ê ]',
+                    'c -> k', 's s -> s', 'n h -> N', 'l h -> L', 'h -> 0', 'r r -> R', 'r -> R || .#. _',
+                    'e -> i || _ (s) .#. , .#. p _ r', 'o -> u || _ (s) .#.', 'd -> J || _ [ i | í ]',
+                    't -> C || _ [ i | í ]', 'z -> s || _ .#.']
+
+compiler = XreCompiler()
+compiler.define_transducer('Vowel', regex(vowel))
+rules = [compiler.compile(rule) for rule in portuguese_rules]
+cascade = compose(rules)
+cascade.minimize()
+cascade.lookup_optimize()
+for rule in rules:
+    rule.lookup_optimize()
+
+pool_transducer = None
+
+def lookup_one(item):
+    return item, sorted({output for output, weight in pool_transducer.lookup(item)})
+
+def lookup_in_parallel(transducer, items, processes=4, chunksize=1000):
+    # Yields each item with its outputs, in the order of the items.
+    global pool_transducer
+    pool_transducer = transducer
+    items = iter(items)
+    with get_context('fork').Pool(processes) as pool:
+        while True:
+            batch = list(islice(items, 2 * processes * chunksize))
+            if not batch:
+                break
+            yield from pool.imap(lookup_one, batch, chunksize)
+
+def unique_lines(filename):
+    seen = set()
+    with open(filename, encoding='utf-8') as lines:
+        for line in lines:
+            line = line.strip()
+            if line and line not in seen:
+                seen.add(line)
+                yield line
+
+def transcribe(input_file, output_file, cascade, processes=4, chunksize=1000):
+    number_of_words = 0
+    with open(output_file, 'w', encoding='utf-8') as output:
+        for word, pronunciations in lookup_in_parallel(cascade, unique_lines(input_file), processes, chunksize):
+            print('\t'.join([word] + pronunciations), file=output)
+            number_of_words += 1
+    return number_of_words
+
+# For comparison, the rules applied one after another to each word, like in a cascade of separate programs:
+
+def apply_rules(word, rules):
+    forms = {word}
+    for rule in rules:
+        forms = {output for form in forms for output, weight in rule.lookup(form)}
+    return sorted(forms)
+
+# A word list of 200000 words made of Portuguese-like syllables, together with the words of section 3.3:
+
+rng = random.Random(0)
+onsets = ['', 'b', 'c', 'ch', 'd', 'f', 'g', 'l', 'lh', 'm', 'n', 'nh', 'p', 'r', 'rr', 's', 'ss', 't', 'v', 'z', 'ç']
+nuclei = ['a', 'e', 'i', 'o', 'u', 'á', 'é', 'í', 'ó', 'ú', 'ã', 'õ', 'ê', 'ô']
+with open('portuguese_words.txt', 'w', encoding='utf-8') as word_list:
+    for word in ['caso', 'disse', 'simpático', 'chato', 'braços']:
+        print(word, file=word_list)
+    for i in range(200000):
+        print(''.join(rng.choice(onsets) + rng.choice(nuclei) for syllable in range(rng.randint(1, 4))) + rng.choice(['', 's', 'z']), file=word_list)
+
+start = perf_counter()
+number_of_words = transcribe('portuguese_words.txt', 'portuguese_pronunciations.tsv', cascade)
+print('composed cascade, 4 processes: %.0f words/s' % (number_of_words / (perf_counter() - start)))
+
+unique_words = list(unique_lines('portuguese_words.txt'))
+for name, transducers in (('composed cascade, 1 process', [cascade]), ('16 rules one after another', rules)):
+    start = perf_counter()
+    for word in unique_words:
+        apply_rules(word, transducers)
+    print('%s: %.0f words/s' % (name, len(unique_words) / (perf_counter() - start)))
+
+with open('portuguese_pronunciations.tsv', encoding='utf-8') as pronunciations:
+    for line in islice(pronunciations, 5):
+        print(line.rstrip('\n'))
+
+# ### 3.7. Compiling long rule cascades
+#
+# When many rules are composed at once, the intermediate networks can grow large before they are minimized.
+# With a hundred rules or more this can use up all memory. We can keep the networks smaller by composing
+# the rules one at a time:
+#
+# <ul>
+#  <li>Give all rules the same alphabet once at the beginning (<i>harmonize</i> them), so that the alphabets need not be harmonized again at every composition.
+#      <code>HfstTransducer</code> has no method for this, but <code>HfstIterableTransducer</code> has: each rule is converted, harmonized with a network
+#      that has the symbols of all rules in its alphabet, and converted back. Then the rules are composed with <code>harmonize=False</code>.</li>
+#  <li>Minimize the result after each composition.</li>
+#  <li>Before each composition, compute a worst-case bound for the size of the result: at most one transition for each pair of transitions of the two networks.
+#      If the memory in use now plus this bound would exceed a memory limit, stop before composing, instead of running out of memory.
+#      The real result is usually much smaller than the bound, so the limit should be generous.</li>
+#  <li>Report the size of the result and the peak memory use of the process during each step.</li>
+# </ul>
+#
+# On Linux, the memory use of a process can be read from the file <code>/proc/self/status</code>: <code>VmRSS</code> is the memory in use now and
+# <code>VmHWM</code> the highest value so far. Writing <code>5</code> to <code>/proc/self/clear_refs</code> resets the highest value to the current one,
+# so we can measure the peak of each step separately. These files exist only on Linux, so the code below runs only there.
+
+# Roughly how many bytes one transition takes in memory.
+ARC_BYTES = 32
+
+def memory_use():
+    # Returns the current and the peak memory use in bytes.
+    with open('/proc/self/status') as status:
+        values = dict(line.split(':', 1) for line in status)
+    return int(values['VmRSS'].split()[0]) * 1024, int(values['VmHWM'].split()[0]) * 1024
+
+def reset_peak_memory():
+    with open('/proc/self/clear_refs', 'w') as clear_refs:
+        clear_refs.write('5')
+
+def compose_cascade(rules, memory_limit=2 * 1024**3):
+    alphabet = HfstIterableTransducer()
+    alphabet.add_symbols_to_alphabet(tuple({symbol for rule in rules for symbol in rule.get_alphabet()}))
+    harmonized = []
+    for rule in rules:
+        fsm = HfstIterableTransducer(rule)
+        fsm.harmonize(alphabet)
+        harmonized.append(HfstTransducer(fsm))
+    rules = harmonized
+    result = rules[0]
+    result.minimize()
+    for step, rule in enumerate(rules[1:], 2):
+        bound = result.number_of_arcs() * rule.number_of_arcs() * ARC_BYTES
+        current, peak = memory_use()
+        if current + bound > memory_limit:
+            raise MemoryError('composing rule %i with the result of rules 1-%i could need up to %i MB (%i x %i transitions) '
+                              'in addition to the %i MB in use, which exceeds the limit of %i MB; '
+                              'try another order of the rules or split the cascade'
+                              % (step, step - 1, bound // 1024**2, result.number_of_arcs(), rule.number_of_arcs(),
+                                 current // 1024**2, memory_limit // 1024**2))
+        reset_peak_memory()
+        start = perf_counter()
+        result.compose(rule, harmonize=False)
+        result.minimize()
+        current, peak = memory_use()
+        print('rule %3i: %6i states, %7i transitions, memory %5i MB, peak during the step %5i MB, %.2f s'
+              % (step, result.number_of_states(), result.number_of_arcs(), current // 1024**2, peak // 1024**2, perf_counter() - start))
+    return result
+
+# The Portuguese rules of section 3.6 were optimized for lookup, so we compile them again:
+
+portuguese_cascade = compose_cascade([compiler.compile(rule) for rule in portuguese_rules])
+print(portuguese_cascade.lookup('simpático'))
+
+# A cascade of 120 random rules with left and right contexts. Composed one at a time, it stays small:
+
+letters = 'abcdefghij'
+random_rules = ['%s -> %s || %s _ %s' % tuple(rng.choice(letters) for i in range(4)) for rule in range(120)]
+random_cascade = compose_cascade([regex(rule) for rule in random_rules])
+
+# With a limit that is too small, we get an error message before the composition is even started:
+
+try:
+    compose_cascade([regex(rule) for rule in random_rules], memory_limit=memory_use()[0] + 1024**2)
+except MemoryError as error:
+    print(error)
+
 # ## 4. Regular expressions in xfst
 #
 # <i>Figures and tables taken from Beesley & Karttunen: Finite State Morphology, CSLI Publications, 2003.</i>
@@ -377,6 +965,57 @@ start_xfst()
 
 start_xfst()
 
+# ### 4.4. Complement and containment over large alphabets
+#
+# Expressions such as <code>?*</code>, <code>~$[ä|ö|y]</code> and <code>$[a|o|u] ~$[ä|ö|y]</code> talk about
+# "any symbol". One might think that a network for them needs one transition per symbol of the alphabet in every state.
+# HFST avoids this with two special symbols:
+#
+# <ul>
+#  <li><code>@_IDENTITY_SYMBOL_@</code> stands for any symbol that is not in the alphabet of the network, mapped to itself</li>
+#  <li><code>@_UNKNOWN_SYMBOL_@</code> stands for any symbol that is not in the alphabet of the network, on one side of a transition</li>
+# </ul>
+#
+# So the vowel harmony rule from example (7) above is small, no matter how many letters the language has.
+# But when the rule is combined with another network, for instance a lexicon, the two networks must agree on what
+# "any other symbol" means. The symbols that are known to the other network are added to the rule network,
+# and each "any other symbol" transition gets a copy for every added symbol. This is called <i>harmonization</i>.
+#
+# Let's measure this. We let the rule meet networks that know all Finnish letters, and all Finnish letters
+# plus 2000 Chinese characters.
+
+from time import perf_counter
+from hfst_dev import regex, compose, HfstIterableTransducer
+
+def size(transducer):
+    fsm = HfstIterableTransducer(transducer)
+    return len(fsm.states()), sum(len(fsm.transitions(state)) for state in fsm.states())
+
+finnish = 'abcdefghijklmnopqrstuvwxyzåäö'
+chinese = ''.join(chr(code) for code in range(0x4E00, 0x4E00 + 2000))
+
+harmony = '[ A -> a || $[a|o|u] ~$[ä|ö|y] _ ] .o. [ A -> ä ]'
+for name, alphabet in (('only the rule', ''), ('Finnish', finnish), ('Finnish and Chinese', finnish + chinese)):
+    start = perf_counter()
+    rule = regex(harmony)
+    if alphabet:
+        rule = compose((regex('[ A | ' + ' | '.join(alphabet) + ' ]*'), rule))
+    print('%s: %i states, %i transitions, %.2f s' % ((name,) + size(rule) + (perf_counter() - start,)))
+
+# The rule itself stays the same size, but every network it is harmonized with multiplies the number of its transitions.
+# So, with a large alphabet:
+#
+# <ul>
+#  <li>Compose the rules with each other first and with the lexicon last. Then the rules are harmonized with the lexicon only once, in the final network, which is big anyway because of the lexicon.</li>
+#  <li>Do not list the whole alphabet in a rule, for instance <code>[a|b|c|...]*</code> instead of <code>?*</code>.</li>
+#  <li>Define the classes of symbols that the rules actually need, such as <code>define BackVowel [a|o|u] ;</code>, and use them in the rules.</li>
+# </ul>
+
+rules = regex(harmony)
+print('rules: %i states, %i transitions' % size(rules))
+lexicon = regex('[{talo} | {kylä} | {kori}] {ssA}')
+print('rules composed with the lexicon: %i states, %i transitions' % size(compose((lexicon, rules))))
+
 # ## 5. Pronunciation lexicon for a Language with Irregular Orthography: English
 #
 # <i>Figures taken from Jurafsky & Martin: Speech and Language Processing, Prentice Hall, 1999.</i>
@@ -437,6 +1076,362 @@ start_xfst()
 # #### Example 2: Spring, Warmth
 #
 # <img src="img/spring_warmth.png">
+#
+# ### 6.2. Applying a cascade of sound changes to a word list
+#
+# A sound change can be written as a replace rule, and the history of a language as an ordered cascade of
+# such rules. Let's take a simplified version of Grimm's law, which describes how the stops of Proto-Indo-European
+# changed in Proto-Germanic, and apply it to a list of words:
+#
+# <ul>
+#  <li>Each stage (rule) is applied to all words of the list in several processes at the same time, with <code>lookup_in_parallel</code> of section 3.6.</li>
+#  <li>The forms after each stage are stored in a cache on disk (using <code>shelve</code>). The key of a stage is a hash of the rule
+#      and the key of the previous stage, so it changes when the rule or any rule before it changes.</li>
+#  <li>If we edit rule <i>k</i>, the stages before <i>k</i> are found in the cache, and only stages <i>k</i> and later are run again.</li>
+#  <li>Optionally, the forms after every stage are returned, not only the final ones.</li>
+# </ul>
+
+import hashlib
+import shelve
+
+def stage_keys(rules):
+    keys, key = [], ''
+    for rule in rules:
+        key = hashlib.sha256((key + '\0' + rule).encode('utf-8')).hexdigest()
+        keys.append(key)
+    return keys
+
+def apply_sound_changes(words, rules, cache_file='sound_changes', intermediate=False, processes=4):
+    words = list(dict.fromkeys(words))
+    forms = {word: [word] for word in words}
+    stages = []
+    with shelve.open(cache_file) as cache:
+        for number, (rule, key) in enumerate(zip(rules, stage_keys(rules)), 1):
+            # The cache of a stage maps each word to its forms after the stage.
+            cached = cache.get(key, {})
+            missing = sorted({form for word in words if word not in cached for form in forms[word]})
+            if missing:
+                print('stage %i: applying %s to %i forms' % (number, rule, len(missing)))
+                sound_change = regex(rule)
+                sound_change.lookup_optimize()
+                outputs = dict(lookup_in_parallel(sound_change, missing, processes))
+                for word in words:
+                    if word not in cached:
+                        cached[word] = sorted({output for form in forms[word] for output in outputs[form]})
+                cache[key] = cached
+            forms = {word: cached[word] for word in words}
+            stages.append(forms)
+    return stages if intermediate else stages[-1]
+
+grimm = ['p -> f , t -> þ , k -> h',                        # voiceless stops become fricatives
+         'b -> p , d -> t , g -> k || _ [ \\ʰ | .#. ]',     # voiced stops become voiceless, but not aspirated ones
+         'b ʰ -> b , d ʰ -> d , g ʰ -> g',                  # aspirated stops lose their aspiration
+         'o -> a']                                          # o becomes a
+pie_words = ['pods', 'trejes', 'kerd', 'bʰrater', 'dekm', 'genu', 'dʰuhmos', 'gʰostis']
+
+stages = apply_sound_changes(pie_words, grimm, intermediate=True)
+for word in pie_words:
+    print(' > '.join([word] + ['/'.join(stage[word]) for stage in stages]))
+
+# The order of the rules matters: if the aspirated stops lost their aspiration first, <i>bʰrater</i> would end up as <i>praþer</i> instead of <i>braþer</i>.
+#
+# When we run the cascade again with a changed last rule, the first three stages come from the cache:
+
+grimm[3] = 'o -> a || _ s'
+print(apply_sound_changes(pie_words, grimm))
+
+# On a larger list of made-up words, we can compare the first run with one where all stages are cached:
+
+pie_words = [''.join(rng.choice(['p', 't', 'k', 'b', 'd', 'g', 'bʰ', 'dʰ', 'gʰ', 'r', 's', 'm', 'n']) + rng.choice('aeiou')
+                     for syllable in range(rng.randint(1, 3))) + 's' for word in range(100000)]
+for run in ('first run', 'second run'):
+    start = perf_counter()
+    apply_sound_changes(pie_words, grimm, cache_file='sound_changes_large')
+    print('%s: %.2f s' % (run, perf_counter() - start))
+
+# ## 7. Analysing large corpora
+#
+# ### 7.1. A pipeline for analysing a corpus
+#
+# In Assignment 5.1 below, a text file is run through an analyzer one line at a time.
+# This is fine for a small file, but a large corpus should be processed in a more clever way:
+#
+# <ul>
+#  <li>Read the file in large blocks and split the blocks into words (tokens).</li>
+#  <li>A corpus contains the same words (types) many times. Collect the types with their frequencies and analyse each type only once.</li>
+#  <li>Analyse the types in several processes at the same time. When the processes are started (forked) after the analyzer has been loaded, they share the same analyzer in memory.</li>
+#  <li>Write each token with its analyses to a file, either as tab-separated values (TSV) or as JSON lines.</li>
+# </ul>
+#
+# The pipeline reports how many tokens per second it processes and how long each stage takes.
+#
+# As an analyzer, we use the Esperanto verb guesser from section 2.4 that we saved to a file in section 2.7:
+
+analyzer = HfstTransducer.read_from_file('esperanto_verbs.hfst')
+analyzer.invert()
+analyzer.lookup_optimize()
+analyzer.write_to_file('esperanto_analyzer.hfst')
+
+# We also need a corpus. We generate one with some verb forms and some other words, 200000 words in total:
+
+import random
+rng = random.Random(0)
+verbs = [root + ending for root in ('dir', 'don', 'est', 'ir', 'pens', 'kant', 'skrib', 'parol', 'labor', 'lern')
+                       for ending in ('as', 'is', 'os', 'us', 'i', 'u', 'adas', 'adis')]
+others = ['la', 'kaj', 'hundo', 'granda', 'en', 'de']
+with open('esperanto_corpus.txt', 'w', encoding='utf-8') as corpus:
+    for line in range(20000):
+        print(' '.join(rng.choices(verbs + others, k=10)), file=corpus)
+
+# The stages of the pipeline:
+
+import re
+import json
+from collections import Counter
+from time import perf_counter
+
+word = re.compile(r'\w+')
+trailing_word = re.compile(r'\w*\Z')
+
+def tokens(filename, block_size=1024*1024):
+    with open(filename, encoding='utf-8') as corpus:
+        rest = ''
+        while True:
+            block = corpus.read(block_size)
+            if not block:
+                break
+            block = rest + block
+            # A word at the end of the block may continue in the next block.
+            end = trailing_word.search(block).start()
+            rest = block[end:]
+            yield from word.findall(block, 0, end)
+        if rest:
+            yield rest
+
+def analyse_types(types, analyzer, processes=4, chunksize=1000):
+    # lookup_in_parallel is defined in section 3.6.
+    return dict(lookup_in_parallel(analyzer, types, processes, chunksize))
+
+def analyse_corpus(corpus_file, analyzer_file, output_file, output_format='tsv', processes=4):
+    times = {}
+    start = perf_counter()
+    analyzer = HfstTransducer.read_from_file(analyzer_file)
+    times['load'] = perf_counter() - start
+    start = perf_counter()
+    types = Counter(tokens(corpus_file))
+    times['tokenize'] = perf_counter() - start
+    start = perf_counter()
+    analyses = analyse_types(types, analyzer, processes)
+    times['analyse'] = perf_counter() - start
+    start = perf_counter()
+    with open(output_file, 'w', encoding='utf-8') as output:
+        for token in tokens(corpus_file):
+            if output_format == 'jsonl':
+                print(json.dumps({'token': token, 'analyses': analyses[token]}, ensure_ascii=False), file=output)
+            else:
+                print('\t'.join([token] + analyses[token]), file=output)
+    times['write'] = perf_counter() - start
+    number_of_tokens = sum(types.values())
+    print('%i tokens, %i types, %.0f tokens/s' % (number_of_tokens, len(types), number_of_tokens / sum(times.values())))
+    for stage, seconds in times.items():
+        print('  %s: %.2f s' % (stage, seconds))
+    return types, analyses
+
+types, analyses = analyse_corpus('esperanto_corpus.txt', 'esperanto_analyzer.hfst', 'esperanto_corpus.tsv')
+
+# For comparison, the same corpus analysed token by token:
+
+start = perf_counter()
+for token in tokens('esperanto_corpus.txt'):
+    analyzer.lookup(token)
+print('%.0f tokens/s' % (sum(types.values()) / (perf_counter() - start)))
+
+# ### 7.2. Words that the analyzer does not recognize
+#
+# In Assignment 5.1 e you are asked to find words that are out of vocabulary (OOV),
+# that is, words that the analyzer cannot analyse. For a large corpus, we want a report of all OOV types,
+# the most frequent first, and the coverage of the analyzer:
+#
+# <ul>
+#  <li>token coverage: the share of the tokens of the corpus that get an analysis</li>
+#  <li>type coverage: the share of the different words (types) that get an analysis</li>
+# </ul>
+#
+# A huge corpus can have more types than fit in memory. When the number of types being counted reaches
+# <code>max_types</code>, the counts are sorted and written to a temporary file (a <i>run</i>), and counting continues from zero.
+# Finally the runs are merged, which gives all types in alphabetical order with their total counts.
+# The OOV types are sorted by frequency in the same way. Memory use then depends on <code>max_types</code>,
+# not on the size of the corpus. Each type is looked up only once, in batches, using <code>analyse_types</code> from section 7.1.
+
+import heapq
+import tempfile
+from itertools import groupby, islice
+from operator import itemgetter
+
+def write_run(items):
+    run = tempfile.TemporaryFile('w+', encoding='utf-8')
+    for type_, count in items:
+        run.write('%s\t%i\n' % (type_, count))
+    run.seek(0)
+    return run
+
+def read_run(run):
+    for line in run:
+        type_, count = line.rstrip('\n').split('\t')
+        yield type_, int(count)
+
+def count_types(filename, max_types=1000000):
+    runs = []
+    counts = Counter()
+    for token in tokens(filename):
+        counts[token] += 1
+        if len(counts) >= max_types:
+            runs.append(write_run(sorted(counts.items())))
+            counts.clear()
+    runs.append(write_run(sorted(counts.items())))
+    merged = heapq.merge(*(read_run(run) for run in runs))
+    for type_, group in groupby(merged, key=itemgetter(0)):
+        yield type_, sum(count for _, count in group)
+    for run in runs:
+        run.close()
+
+def by_frequency(item):
+    return -item[1], item[0]
+
+def oov_report(corpus_file, analyzer_file, output_file, max_types=1000000, processes=4):
+    analyzer = HfstTransducer.read_from_file(analyzer_file)
+    number_of_tokens = known_tokens = number_of_types = known_types = 0
+    oov, oov_runs = [], []
+    types = count_types(corpus_file, max_types)
+    while True:
+        batch = dict(islice(types, max_types))
+        if not batch:
+            break
+        analyses = analyse_types(batch, analyzer, processes)
+        for type_, count in batch.items():
+            number_of_tokens += count
+            number_of_types += 1
+            if analyses[type_]:
+                known_tokens += count
+                known_types += 1
+            else:
+                oov.append((type_, count))
+        if len(oov) >= max_types:
+            oov_runs.append(write_run(sorted(oov, key=by_frequency)))
+            oov = []
+    oov_runs.append(write_run(sorted(oov, key=by_frequency)))
+    with open(output_file, 'w', encoding='utf-8') as output:
+        for type_, count in heapq.merge(*(read_run(run) for run in oov_runs), key=by_frequency):
+            print('%s\t%i' % (type_, count), file=output)
+    for run in oov_runs:
+        run.close()
+    print('token coverage: %.2f %% (%i / %i)' % (100 * known_tokens / max(number_of_tokens, 1), known_tokens, number_of_tokens))
+    print('type coverage: %.2f %% (%i / %i)' % (100 * known_types / max(number_of_types, 1), known_types, number_of_types))
+
+# Let's try it with the corpus from section 7.1. The corpus is small, so we use a very small <code>max_types</code>
+# to see that the runs work:
+
+oov_report('esperanto_corpus.txt', 'esperanto_analyzer.hfst', 'esperanto_oov.tsv', max_types=10)
+with open('esperanto_oov.tsv', encoding='utf-8') as report:
+    print(report.read())
+
+# ### 7.3. Loading large analyzers
+#
+# In Assignment 5.1 b, a complete analyzer of a language is read from a file with <code>HfstTransducer.read_from_file</code>.
+# This can take several seconds and a lot of memory before the first word can be looked up.
+# How long it takes depends a lot on the format of the file:
+#
+# <ul>
+#  <li>A transducer in OpenFST format (<code>TROPICAL_OPENFST</code>) is a general network. Before lookup it must be converted to an efficient form, which takes time and memory.</li>
+#  <li>A transducer in <i>optimized lookup</i> format (<code>HFST_OL</code>, or <code>HFST_OLW</code> when weighted) is stored as the tables that lookup uses, so it can be used right after reading. This is what <code>lookup_optimize</code> creates.</li>
+# </ul>
+#
+# HFST reads the whole transducer at once; there is no way to read only parts of the tables when they are needed.
+# But we can do the next best things:
+#
+# <ul>
+#  <li>Read only the header of the file when the analyzer is created. The header tells the type and name of the transducer, and a file that is not an HFST transducer is noticed at once.</li>
+#  <li>Read the transducer itself only when the first word is looked up.</li>
+#  <li>If the transducer is not in optimized lookup format, convert it once and save the result next to the original file (with extension <code>.hfstol</code>), so that next time the converted file can be read directly.</li>
+# </ul>
+
+import os
+
+def read_header(filename):
+    # An HFST file starts with "HFST", the size of the header and pairs of names and values, all separated with zero bytes.
+    with open(filename, 'rb') as f:
+        if f.read(5) != b'HFST\0':
+            raise ValueError('%s is not an HFST transducer file' % filename)
+        size = int.from_bytes(f.read(2), 'little')
+        f.read(1)
+        fields = f.read(size).decode('utf-8').split('\0')
+    return dict(zip(fields[0::2], fields[1::2]))
+
+class LazyAnalyzer:
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.header = read_header(filename)
+        self.analyzer = None
+
+    def load(self):
+        if self.analyzer is None:
+            if self.header.get('type') in ('HFST_OL', 'HFST_OLW'):
+                self.analyzer = HfstTransducer.read_from_file(self.filename)
+            else:
+                optimized = os.path.splitext(self.filename)[0] + '.hfstol'
+                if os.path.exists(optimized) and os.path.getmtime(optimized) >= os.path.getmtime(self.filename):
+                    self.analyzer = HfstTransducer.read_from_file(optimized)
+                else:
+                    self.analyzer = HfstTransducer.read_from_file(self.filename)
+                    self.analyzer.lookup_optimize()
+                    self.analyzer.write_to_file(optimized)
+        return self.analyzer
+
+    def lookup(self, word, **kwargs):
+        return self.load().lookup(word, **kwargs)
+
+# Let's save the Esperanto analyzer also in OpenFST format and look at the headers:
+
+tropical = HfstTransducer.read_from_file('esperanto_verbs.hfst')
+tropical.invert()
+tropical.write_to_file('esperanto_analyzer_tropical.hfst')
+print(read_header('esperanto_analyzer_tropical.hfst'))
+print(read_header('esperanto_analyzer.hfst'))
+
+lazy = LazyAnalyzer('esperanto_analyzer_tropical.hfst')
+print(lazy.lookup('donadas'))
+
+# To measure the time until the first lookup is ready and the memory used, each measurement is run in a new Python process.
+# The time for importing <code>hfst_dev</code> is not included, but the memory used by the library is.
+
+import subprocess
+import sys
+
+probe = """
+import resource, sys, time
+from hfst_dev import HfstTransducer
+start = time.perf_counter()
+HfstTransducer.read_from_file(sys.argv[1]).lookup(sys.argv[2])
+print('%.3f s, %i MB' % (time.perf_counter() - start, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024))
+"""
+
+def benchmark_loading(filename, word):
+    result = subprocess.run([sys.executable, '-c', probe, filename, word], capture_output=True, text=True, check=True)
+    print('%s (%s): %s' % (filename, read_header(filename).get('type'), result.stdout.strip()))
+
+benchmark_loading('esperanto_analyzer_tropical.hfst', 'donadas')
+benchmark_loading('esperanto_analyzer_tropical.hfstol', 'donadas')
+
+# The Esperanto analyzer is small, so the differences are small, too.
+# Try the same with the analyzer that you downloaded in Assignment 5.1, for instance:
+#
+# ```
+# lazy = LazyAnalyzer('omorfi.describe.hfst')
+# lazy.lookup('talossa')
+# benchmark_loading('omorfi.describe.hfst', 'talossa')
+# benchmark_loading('omorfi.describe.hfstol', 'talossa')
+# ```
 
 # ## More information
 #
@@ -444,7 +1439,7 @@ start_xfst()
 #  <li>Selected parts of Chapter 2 and 3 of the Beesley & Karttunen book: “A Systematic Introduction” and “The xfst Interface”</li>
 # </ul>
 #
-# ## 7. Assignments
+# ## 8. Assignments
 #
 # ### Assignment 5.1: Analysis of vocabularies
 #
@@ -261,6 +261,305 @@ tr.minimize()
 # <li><a href="https://www.tutorialspoint.com/automata_theory/dfa_minimization.htm">minimization</a></li>
 # </ul>
 
+# ### 1.6. Building large networks from arrays
+#
+# Above, every transition was added with its own call to <code>add_transition</code>.
+# That is fine for a small lexicon, but when a network with millions of transitions is generated from data,
+# the Python calls take most of the time.
+#
+# Instead, the whole network can be described with a few arrays, one item per transition:
+#
+# <ul>
+#  <li><code>sources</code> and <code>targets</code>: the start and target states of the transitions</li>
+#  <li><code>inputs</code> and <code>outputs</code>: the input and output symbols, given as indices to a symbol table</li>
+#  <li><code>weights</code>: the weights of the transitions</li>
+# </ul>
+#
+# In addition, <code>final_weights</code> gives the final weight of each state, with infinity for states that are not final.
+# We use <a href="https://numpy.org/">NumPy</a> arrays for these.
+#
+# HFST keeps its networks in its own data structures, and there is no function in the Python bindings that would
+# build a network from all transitions at once in C++. (<code>read_att_string</code> is no shortcut either: it parses
+# the AT&T text in Python and calls <code>add_transition</code> for each line.) So each transition still takes one
+# Python call. What we can avoid is the work around the calls:
+#
+# <ul>
+#  <li><code>tolist()</code> converts each column into a Python list in one go, so the loop does not handle NumPy scalars one at a time.</li>
+#  <li>The symbols are taken from a list by index, and <code>add_transition</code> is looked up only once, as in section 1.1.</li>
+# </ul>
+
+import numpy as np
+
+def arrays_to_transducer(sources, targets, inputs, outputs, weights, symbols, final_weights):
+    fsm = HfstIterableTransducer()
+    add_transition = fsm.add_transition
+    symbols = list(symbols)
+    columns = (np.asarray(column).tolist() for column in (sources, targets, inputs, outputs, weights))
+    for source, target, input, output, weight in zip(*columns):
+        add_transition(source, target, symbols[input], symbols[output], weight)
+    final_weights = np.asarray(final_weights)
+    finals = np.flatnonzero(np.isfinite(final_weights))
+    for state, weight in zip(finals.tolist(), final_weights[finals].tolist()):
+        fsm.set_final_weight(state, weight)
+    return HfstTransducer(fsm)
+
+# The other direction goes through AT&T format: printing a transducer gives its AT&T representation.
+# Regular expressions pick the transitions and final states from the text, and <code>np.unique</code>
+# builds the symbol table and the symbol indices in one go.
+
+import re
+
+# A transition has four or five fields (the weight is optional), a final state one or two.
+att_arc = re.compile(r'^(\d+)\t(\d+)\t([^\t\n]+)\t([^\t\n]+)(?:\t([^\t\n]+))?$', re.MULTILINE)
+att_final = re.compile(r'^(\d+)(?:\t([^\t\n]+))?$', re.MULTILINE)
+
+def unescape(symbol):
+    return {'@0@': EPSILON, '@_SPACE_@': ' ', '@_TAB_@': '\t'}.get(symbol, symbol)
+
+def transducer_to_arrays(transducer):
+    att = str(transducer)
+    arcs = np.array(att_arc.findall(att), dtype=object).reshape(-1, 5)
+    arcs[arcs[:, 4] == '', 4] = '0'
+    finals = np.array(att_final.findall(att), dtype=object).reshape(-1, 2)
+    finals[finals[:, 1] == '', 1] = '0'
+    sources, targets, final_states = arcs[:, 0].astype(np.int64), arcs[:, 1].astype(np.int64), finals[:, 0].astype(np.int64)
+    symbols, ids = np.unique(arcs[:, 2:4].astype(str), return_inverse=True)
+    ids = ids.reshape(-1, 2)
+    number_of_states = 1 + max(sources.max(initial=0), targets.max(initial=0), final_states.max(initial=0))
+    final_weights = np.full(number_of_states, np.inf)
+    final_weights[final_states] = finals[:, 1].astype(np.float64)
+    return (sources, targets, ids[:, 0], ids[:, 1], arcs[:, 4].astype(np.float64),
+            [unescape(str(symbol)) for symbol in symbols], final_weights)
+
+# Let's test these with the weighted transducer from section 6.4 of Lecture 3.
+# From the transducer to the arrays and back again, we should get the same transducer.
+
+wfst = HfstIterableTransducer()
+wfst.add_transition(0, 1, 'a', 'x', 0.5)
+wfst.add_transition(0, 1, 'b', 'y', 1.5)
+wfst.add_transition(1, 2, 'c', 'z', 2.5)
+wfst.set_final_weight(2, 3.5)
+wfst = HfstTransducer(wfst)
+
+arrays = transducer_to_arrays(wfst)
+print(arrays)
+assert(arrays_to_transducer(*arrays).compare(wfst))
+print(arrays_to_transducer(*arrays).lookup('ac'))
+
+# How much does this save? Let's build random networks of different sizes both with <code>arrays_to_transducer</code>
+# and with a loop that reads the NumPy arrays item by item. (The item-by-item loop is only timed for the smaller networks.)
+
+from time import perf_counter
+
+def random_network(number_of_arcs, number_of_symbols=100):
+    rng = np.random.default_rng(0)
+    number_of_states = max(number_of_arcs // 10, 1)
+    symbols = [EPSILON] + ['s%i' % i for i in range(1, number_of_symbols)]
+    final_weights = np.where(rng.random(number_of_states) < 0.1, rng.random(number_of_states), np.inf)
+    return (rng.integers(0, number_of_states, number_of_arcs), rng.integers(0, number_of_states, number_of_arcs),
+            rng.integers(0, number_of_symbols, number_of_arcs), rng.integers(0, number_of_symbols, number_of_arcs),
+            rng.random(number_of_arcs), symbols, final_weights)
+
+def benchmark(number_of_arcs):
+    sources, targets, inputs, outputs, weights, symbols, final_weights = network = random_network(number_of_arcs)
+    start = perf_counter()
+    tr = arrays_to_transducer(*network)
+    built = perf_counter() - start
+    start = perf_counter()
+    transducer_to_arrays(tr)
+    read = perf_counter() - start
+    print('%i arcs: %.2f s from arrays, %.2f s to arrays' % (number_of_arcs, built, read))
+    if number_of_arcs <= 100000:
+        start = perf_counter()
+        fsm = HfstIterableTransducer()
+        for i in range(number_of_arcs):
+            fsm.add_transition(int(sources[i]), int(targets[i]), symbols[inputs[i]], symbols[outputs[i]], float(weights[i]))
+        for state in np.flatnonzero(np.isfinite(final_weights)):
+            fsm.set_final_weight(int(state), float(final_weights[state]))
+        HfstTransducer(fsm)
+        print('%i arcs: %.2f s item by item' % (number_of_arcs, perf_counter() - start))
+
+for number_of_arcs in (10000, 100000, 1000000):
+    benchmark(number_of_arcs)
+
+# A network with ten million transitions takes a few minutes and several gigabytes of memory:
+#
+# ```
+# benchmark(10000000)
+# ```
+
+# ### 1.7. A compact read-only network
+#
+# When a network is walked through with <code>HfstIterableTransducer</code>, a new Python object is created
+# for every transition that is visited. For analyses that go through all transitions of a large network,
+# it is faster to use arrays like those of section 1.6 and let NumPy do the work.
+#
+# The transitions are sorted by their start state. Then the transitions of state <code>s</code> are found at
+# positions <code>offsets[s]</code> ... <code>offsets[s+1]-1</code> of the arrays <code>targets</code>, <code>inputs</code>,
+# <code>outputs</code> and <code>weights</code>, and the start states need not be stored at all.
+# (This layout is known as <i>compressed sparse row</i>, CSR.)
+# The arrays are made read-only, so that the network cannot be modified by accident.
+
+class PackedTransducer:
+
+    def __init__(self, sources, targets, inputs, outputs, weights, symbols, final_weights):
+        sources = np.asarray(sources)
+        order = np.argsort(sources, kind='stable')
+        self.symbols = tuple(symbols)
+        self.symbol_ids = {symbol: i for i, symbol in enumerate(self.symbols)}
+        self.final_weights = np.array(final_weights, dtype=np.float64)
+        transitions_per_state = np.bincount(sources, minlength=len(self.final_weights))
+        self.offsets = np.concatenate(([0], np.cumsum(transitions_per_state)))
+        self.targets = np.asarray(targets)[order]
+        self.inputs = np.asarray(inputs)[order]
+        self.outputs = np.asarray(outputs)[order]
+        self.weights = np.asarray(weights, dtype=np.float64)[order]
+        for array in (self.final_weights, self.offsets, self.targets, self.inputs, self.outputs, self.weights):
+            array.flags.writeable = False
+
+    @classmethod
+    def from_transducer(cls, transducer):
+        return cls(*transducer_to_arrays(transducer))
+
+    def to_transducer(self):
+        sources = np.repeat(np.arange(self.number_of_states()), np.diff(self.offsets))
+        return arrays_to_transducer(sources, self.targets, self.inputs, self.outputs,
+                                    self.weights, self.symbols, self.final_weights)
+
+    def number_of_states(self):
+        return len(self.offsets) - 1
+
+    def transitions(self, state):
+        # Views to the arrays; nothing is copied.
+        arcs = slice(self.offsets[state], self.offsets[state + 1])
+        return self.targets[arcs], self.inputs[arcs], self.outputs[arcs], self.weights[arcs]
+
+    def __iter__(self):
+        for state in range(self.number_of_states()):
+            yield (state,) + self.transitions(state)
+
+# Let's pack the lexicon that we built in section 1.1 and check that we get the same network back:
+
+packed = PackedTransducer.from_transducer(HfstTransducer(lexicon))
+assert(packed.to_transducer().compare(HfstTransducer(lexicon)))
+
+targets, inputs, outputs, weights = packed.transitions(0)
+print([(packed.symbols[i], int(target)) for i, target in zip(inputs, targets)])
+
+# Questions about the whole network can now be answered with array operations.
+# For instance, how many transitions leave each state, which states have epsilon transitions,
+# and how many times each symbol is used:
+
+print(np.diff(packed.offsets))
+
+sources = np.repeat(np.arange(packed.number_of_states()), np.diff(packed.offsets))
+print(np.unique(sources[packed.inputs == packed.symbol_ids[EPSILON]]))
+
+print(dict(zip(packed.symbols, np.bincount(packed.inputs, minlength=len(packed.symbols)).tolist())))
+
+# ### 1.8. Viewing large networks
+#
+# The <code>view</code> function draws the whole network. With thousands of states, graphviz takes a long time
+# and the picture is impossible to read anyway. A better idea is to look at a part of the network at a time:
+#
+# <ul>
+#  <li>Start from a chosen state and collect the states that are closest to it (breadth-first search), until there are as many states as we want to see.</li>
+#  <li>Or collect small neighbourhoods around some randomly chosen states, to get an idea of what the network looks like in general.</li>
+#  <li>Draw all parallel transitions between two states as one arc with a list of labels, showing only the first few of them.</li>
+#  <li>Transitions that lead out of the selected part are drawn as dashed arcs to a node marked with "...".</li>
+#  <li>Stop writing the graphviz (DOT) description when it gets too long.</li>
+# </ul>
+#
+# We use the packed networks of section 1.7, so that the transitions of a state are quick to get.
+
+import random
+from collections import deque
+
+def neighbourhood(packed, start=0, max_states=50):
+    states = {start}
+    queue = deque([start])
+    while queue and len(states) < max_states:
+        for target in packed.transitions(queue.popleft())[0].tolist():
+            if target not in states and len(states) < max_states:
+                states.add(target)
+                queue.append(target)
+    return states
+
+def sample_neighbourhoods(packed, max_states=50, samples=5, seed=None):
+    starts = random.Random(seed).sample(range(packed.number_of_states()), min(samples, packed.number_of_states()))
+    states = set()
+    for start in starts:
+        states |= neighbourhood(packed, start, max(max_states // samples, 1))
+    return states
+
+def arc_label(packed, insym, outsym, weight):
+    insym, outsym = (packed.symbols[symbol].replace(EPSILON, 'ε') for symbol in (insym, outsym))
+    label = insym if insym == outsym else insym + ':' + outsym
+    return label if weight == 0 else '%s/%g' % (label, weight)
+
+def to_dot(packed, states, max_labels=3, max_size=100000):
+    dot = ['digraph {', 'rankdir = LR;']
+    for state in sorted(states):
+        shape = 'doublecircle' if np.isfinite(packed.final_weights[state]) else 'circle'
+        dot.append('%i [shape = %s];' % (state, shape))
+    size = sum(len(line) + 1 for line in dot)
+    for state in sorted(states):
+        targets, inputs, outputs, weights = packed.transitions(state)
+        labels = {}
+        for target, insym, outsym, weight in zip(targets.tolist(), inputs.tolist(), outputs.tolist(), weights.tolist()):
+            target = target if target in states else None
+            labels.setdefault(target, []).append(arc_label(packed, insym, outsym, weight))
+        for target, arc_labels in labels.items():
+            label = ', '.join(arc_labels[:max_labels])
+            if len(arc_labels) > max_labels:
+                label += ', ... (%i more)' % (len(arc_labels) - max_labels)
+            label = label.replace('\\', '\\\\').replace('"', '\\"')
+            if target is None:
+                lines = ['"out%i" [shape = plaintext, label = "..."];' % state,
+                         '%i -> "out%i" [style = dashed, label = "%s"];' % (state, state, label)]
+            else:
+                lines = ['%i -> %i [label = "%s"];' % (state, target, label)]
+            size += sum(len(line) + 1 for line in lines)
+            if size > max_size:
+                dot.append('"truncated" [shape = box, label = "(truncated)"];')
+                dot.append('}')
+                return '\n'.join(dot)
+            dot.extend(lines)
+    dot.append('}')
+    return '\n'.join(dot)
+
+# Graphviz runs as a separate program, so the drawing can be done in a background thread while the notebook
+# stays responsive. <code>view_part</code> returns at once; the image (in SVG format) is available when the
+# rendering has finished.
+
+import graphviz
+from concurrent.futures import ThreadPoolExecutor
+from IPython.display import SVG
+
+renderer = ThreadPoolExecutor(max_workers=1)
+
+def view_part(packed, start=0, max_states=50, sample=False, max_labels=3, max_size=100000):
+    if sample:
+        states = sample_neighbourhoods(packed, max_states)
+    else:
+        states = neighbourhood(packed, start, max_states)
+    dot = to_dot(packed, states, max_labels, max_size)
+    return renderer.submit(graphviz.Source(dot).pipe, format='svg')
+
+# Let's create a random network with 100000 states and a million transitions (see section 1.6)
+# and look at the 20 states closest to the initial state:
+
+big = PackedTransducer(*random_network(1000000))
+rendering = view_part(big, start=0, max_states=20)
+
+# The notebook can be used while the image is being rendered. The next cell waits until it is ready:
+
+SVG(rendering.result())
+
+# And the same for some random parts of the network:
+
+SVG(view_part(big, max_states=20, sample=True).result())
+
 # ## 2. Optimizing weighted finite-state networks
 #
 # Optimizing weighted finite-state networks is basically the same as unweighted networks, but the weights may mess things up.
@@ -376,7 +675,103 @@ tr.view()
 # Mehryar Mohri did not work on morphology, but on automatic speech recognition:
 #
 # <img src="img/speech_recognition.png">
+
+# ### 2.5. Total weight of a word form
 #
+# <code>lookup</code> gives each analysis of a word form with its own weight, that is, the weights are combined in the tropical semiring:
+# the best analysis wins. In the beginning of this section, we computed <code>Prob(tuoksua as a noun or verb)</code>,
+# which is the sum over all analyses, that is, the word form weight in the log semiring.
+#
+# We can compute this without listing the analyses one by one:
+#
+# <ul>
+#  <li>Compose the word form with the analyzer. The result is a small network, a <i>lattice</i>, that contains all analyses of the word.</li>
+#  <li>Go through the states of the lattice in an order where a state comes after all the states that have transitions to it.</li>
+#  <li>For every state, compute the ⊕-sum (in the log semiring) of the weights of all paths from the initial state to it. This is called the <i>forward</i> weight of the state.</li>
+#  <li>The total weight of the word form is the ⊕-sum of the forward weights of the final states (with their final weights added).</li>
+# </ul>
+#
+# The log semiring ⊕ of section 2.3 is computed with NumPy's <code>logaddexp</code>.
+# It works with natural logarithms, so the weights (which are logarithms with base 10) are multiplied by ln 10.
+# To process many word forms at once, their lattices are put side by side into one big network,
+# and all states that are ready are handled in one step.
+#
+# Let's first make an analyzer with the probabilities from the beginning of this section:
+
+from hfst_dev import compile_lexc_script, compose, HfstTokenizer, tokenized_fst
+
+generator = compile_lexc_script("""
+Multichar_Symbols +N +V +Par +Inf
+
+LEXICON Root
+Nouns "weight: 0.30103" ;      ! Prob(Noun) = 0.5
+Verbs "weight: 0.52288" ;      ! Prob(Verb) = 0.3
+
+LEXICON Nouns
+tuoksu   NounEndings "weight: 4.00000" ;    ! Prob(tuoksu | Noun) = 0.0001
+
+LEXICON NounEndings
++N+Par:a   # "weight: 1.00000" ;            ! Prob(Noun ending -a) = 0.1
+
+LEXICON Verbs
+tuoksu   VerbEndings "weight: 3.00000" ;    ! Prob(tuoksu | Verb) = 0.001
+
+LEXICON VerbEndings
++V+Inf:a   # "weight: 1.30103" ;            ! Prob(Verb ending -a) = 0.05
+
+END
+""")
+analyzer = HfstTransducer(generator)
+analyzer.invert()
+print(analyzer.lookup('tuoksua'))
+
+# Then the computation itself:
+
+LN10 = np.log(10)
+
+def total_weights(analyzer, words):
+    tokenizer = HfstTokenizer()
+    for symbol in analyzer.get_alphabet():
+        if len(symbol) > 1:
+            tokenizer.add_multichar_symbol(symbol)
+    sources, targets, weights, final_weights, initial_states, word_of_state = [], [], [], [], [], []
+    number_of_states = 0
+    for i, word in enumerate(words):
+        lattice = compose((tokenized_fst(tokenizer.tokenize_one_level(word)), analyzer))
+        arrays = transducer_to_arrays(lattice)
+        # Renumber the states, so that the lattices do not overlap.
+        sources.append(arrays[0] + number_of_states)
+        targets.append(arrays[1] + number_of_states)
+        weights.append(arrays[4])
+        final_weights.append(arrays[6])
+        initial_states.append(number_of_states)
+        word_of_state.append(np.full(len(arrays[6]), i))
+        number_of_states += len(arrays[6])
+    sources, targets, weights, final_weights, word_of_state = (
+        np.concatenate(arrays) for arrays in (sources, targets, weights, final_weights, word_of_state))
+    # Forward weights as natural logarithms of probabilities
+    forward = np.full(number_of_states, -np.inf)
+    forward[initial_states] = 0.0
+    incoming = np.bincount(targets, minlength=number_of_states)
+    ready = np.flatnonzero(incoming == 0)
+    while len(ready) > 0:
+        is_ready = np.zeros(number_of_states, dtype=bool)
+        is_ready[ready] = True
+        arcs = np.flatnonzero(is_ready[sources])
+        np.logaddexp.at(forward, targets[arcs], forward[sources[arcs]] - weights[arcs] * LN10)
+        np.subtract.at(incoming, targets[arcs], 1)
+        ready = np.unique(targets[arcs][incoming[targets[arcs]] == 0])
+    if incoming.any():
+        raise ValueError('a lattice has a cycle')
+    totals = np.full(len(words), -np.inf)
+    np.logaddexp.at(totals, word_of_state, forward - final_weights * LN10)
+    return -totals / LN10
+
+print(total_weights(analyzer, ['tuoksua', 'tuoksu', 'kissa']))
+
+# For <code>tuoksua</code>, we get 4.69897, which is – log<sub>10</sub> 0.00002, as calculated in the beginning of this section.
+# The two other words have no analyses, so their weights are infinite.
+
 # ## Further reading
 #
 # <ul>
@@ -11,6 +11,7 @@ cp -r /home/jovyan/work/compmorph-course/* /home/jovyan/
 
 python3 -m pip install graphviz
 python3 -m pip install hfst-dev
+python3 -m pip install numpy
 
 rm -fR src
 rm -fR work